@@ -850,6 +850,7 @@ class BKZTreeTracer(Tracer):
         Tracer.__init__(self, instance, verbosity, max_depth)
         self.trace = Node(root_label)
         self.current = self.trace
+        self.quality = None  # basis quality as of the most recently finished tour
         if start_clocks:
             self.reenter()
 
@@ -907,11 +908,13 @@ class BKZTreeTracer(Tracer):
 
         if label[0] == "tour":
             data = basis_quality(self.instance.M)
+            self.quality = data
+            node_data = node.data
             for k, v in data.items():
                 if k == "/":
-                    node.data[k] = Accumulator(v, repr="max")
+                    node_data[k] = Accumulator(v, repr="max")
                 else:
-                    node.data[k] = Accumulator(v, repr="min")
+                    node_data[k] = Accumulator(v, repr="min")
 
         if self.verbosity and label[0] == "tour":
             report = OrderedDict()
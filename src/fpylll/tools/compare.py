@@ -14,16 +14,17 @@ the construction of param objects can be rolled into the class description. See
 
 from __future__ import absolute_import
 from collections import OrderedDict
+from functools import partial, lru_cache
 from fpylll import IntegerMatrix, BKZ
 from fpylll import FPLLL
 from fpylll.tools.bkz_stats import BKZTreeTracer, dummy_tracer, pretty_dict
 from fpylll.tools.quality import basis_quality
 from fpylll.util import ReductionError
 
-from multiprocessing import Pool
+import multiprocessing
 import logging
+import sys
 import copy
-import time
 import pickle
 
 import fpylll.algorithms.bkz
@@ -32,6 +33,55 @@ import fpylll.algorithms.bkz2
 
 # Utility Functions
 
+# Matrices looked up by key in ``play``, populated by ``compare_bkz`` before the worker pool is forked
+# so that workers inherit them instead of unpickling a copy per job.
+_SHARED = {}
+
+
+def _mp_context():
+    """Return a ``fork`` multiprocessing context if the platform supports it, the default otherwise.
+
+    On macOS forking is unsafe once system frameworks are loaded, hence the default (``spawn``) is
+    always used there.
+    """
+    if sys.platform != "darwin" and "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+@lru_cache(maxsize=128)
+def _cached_random_matrix(dimension, seed, kwds):
+    # ``seed`` is only part of the key, the caller seeds the random number generator.  Cached
+    # matrices stay alive until evicted or until ``_cached_random_matrix.cache_clear()`` is called.
+    return IntegerMatrix.random(dimension, **dict(kwds))
+
+
+def _random_matrix(dimension, seed, kwds):
+    """Return ``IntegerMatrix.random(dimension, **dict(kwds))`` with the random seed set to ``seed``.
+
+    Matrices are cached, so repeated calls with the same parameters, e.g. from repeated
+    ``compare_bkz`` runs over overlapping grids, skip generation.  Each call returns a fresh copy.
+
+    :param dimension: passed to ``IntegerMatrix.random``
+    :param seed: random seed
+    :param kwds: keyword arguments for ``IntegerMatrix.random`` as ``tuple(sorted(kwds.items()))``,
+        matrices are not cached if they are unhashable
+
+    ..  note :: The random seed is set to ``seed`` again before returning, so that later random
+        choices, e.g. in BKZ 2.0, do not depend on whether the matrix was generated or cached.
+
+    """
+    FPLLL.set_random_seed(seed)
+    try:
+        hash(kwds)
+    except TypeError:
+        A = IntegerMatrix.random(dimension, **dict(kwds))
+    else:
+        A = copy.copy(_cached_random_matrix(dimension, seed, kwds))
+    FPLLL.set_random_seed(seed)
+    return A
+
+
 def play(BKZ, A, block_size, tours, progressive_step_size=None):
     """Call ``BKZ`` on ``A`` with ``block_size`` for the given number of ``tours``.
 
@@ -39,7 +89,7 @@ def play(BKZ, A, block_size, tours, progressive_step_size=None):
     ``progressive_step_size``. Providing ``None`` for this parameter disables the progressive strategy.
 
     :param BKZ: a BKZ class whose ``__call__`` accepts a single block size as parameter
-    :param A: an integer matrix
+    :param A: an integer matrix or a key into ``_SHARED``, it is copied before reduction
     :param block_size: a block size >= 2
     :param tours: number of tours >= 1
     :param progressive_step_size: step size for progressive strategy
@@ -48,7 +98,14 @@ def play(BKZ, A, block_size, tours, progressive_step_size=None):
     ..  note :: This function essentially reimplements ``BKZ.__call__`` but supports the
         progressive strategy.
     """
-    bkz = BKZ(copy.copy(A))
+    if not isinstance(A, IntegerMatrix):
+        A = _SHARED[A]
+    return _play(BKZ, copy.copy(A), block_size, tours, progressive_step_size)
+
+
+def _play(BKZ, A, block_size, tours, progressive_step_size=None):
+    "Like ``play`` but ``A`` must be an integer matrix and is reduced in place."
+    bkz = BKZ(A)
     tracer = BKZTreeTracer(bkz, start_clocks=True)
 
     # this essentially initialises the GSO object, LLL was already run by the constructor, so this
@@ -72,25 +129,55 @@ def play(BKZ, A, block_size, tours, progressive_step_size=None):
     tracer.exit()
     trace = tracer.trace
 
-    quality = basis_quality(bkz.M)
-    for k, v in quality.items():
-        trace.data[k] = v
+    # the basis did not change since the tracer evaluated it at the end of the last tour
+    quality = tracer.quality
+    if quality is None:
+        quality = basis_quality(bkz.M)
+    trace.data.update(quality)
 
     return trace
 
 
+def _play_star(job, private=False):
+    """Call ``play`` on a ``(tag, args)`` pair and return ``(tag, trace)``.
+
+    A ``ReductionError`` is returned instead of raised so that one failing job does not abort the
+    collection of all other results.
+
+    :param job: a pair ``(tag, args)``
+    :param private: if ``True`` integer matrices in ``args`` are owned by this call, e.g. because they
+        were just unpickled by a pool worker, and are reduced without copying them first.  Matrices
+        looked up in ``_SHARED`` are always copied.
+    """
+    tag, args = job
+    play_ = _play if private and isinstance(args[1], IntegerMatrix) else play
+    try:
+        return tag, play_(*args)
+    except ReductionError as e:
+        return tag, e
+
+
 class Conductor(object):
     """
     A conductor is our main class for launching block-wise lattice reductions and collecting the outputs.
     """
-    def __init__(self, threads=1, pickle_jar=None, logger="."):
+    def __init__(self, threads=1, pickle_jar=None, logger=".", initializer=None, initargs=()):
         """Create a new conductor object.
 
         :param threads: number of threads
         :param pickle_jar: dump traces to this file continuously
+        :param initializer: if not ``None`` each worker calls ``initializer(*initargs)`` once when it
+            starts
+        :param initargs: arguments for ``initializer``
+
+        ..  note :: For ``threads > 1`` a worker pool is started once and reused for all jobs passed
+            to this conductor, call ``close`` or ``terminate`` to release it.
 
         """
-        self.pool = Pool(processes=threads)
+        if threads > 1:
+            self.pool = _mp_context().Pool(processes=threads, initializer=initializer, initargs=initargs)
+        else:
+            self.pool = None
         self.threads = threads
         self.pickle_jar = pickle_jar
         self.logger = logging.getLogger(logger)
@@ -107,42 +194,50 @@ class Conductor(object):
         self._major_strlen = max(len(str(major)), self._major_strlen)
         self._minor_strlen = max(len(str(minor)), self._minor_strlen)
 
+    def close(self):
+        "Shut down the worker pool, if any, after all submitted jobs finished."
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def terminate(self):
+        "Shut down the worker pool, if any, discarding all outstanding jobs."
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
     @staticmethod
     def dump(data, filename):
         "Pickle ``data`` to ``filename``"
-        pickle.dump(data, open(filename, "wb"))
+        with open(filename, "wb") as fh:
+            pickle.dump(data, fh, pickle.HIGHEST_PROTOCOL)
 
-    def wait_on(self, outputs, todo, sleep=1):
+    def wait_on(self, outputs, todo):
         """Wait for jobs in ``todo`` to return and store results in ``outputs``.
 
         :param outputs: store results here
-        :param todo: these are running jobs
-        :param sleep: seconds to sleep before checking if new results are availabl.
+        :param todo: an iterator over ``(tag, result)`` pairs as produced by ``_play_star``, results
+            are stored as soon as they become available.
 
         """
 
         fmtstr = self._majorminor_format_str()
 
-        while todo:
-            collect = [(tag, res) for (tag, res) in todo if res.ready()]
-
-            for tag, res in collect:
-                major, minor = tag
-                try:
-                    res = res.get()
-                    if major not in outputs:
-                        outputs[major] = []
-                    outputs[major].append((minor, res))
-                    self.logger.debug(fmtstr%(major, minor, pretty_dict(res.data)))
-
-                    if self.pickle_jar is not None:
-                        Conductor.dump(self.outputs, self.pickle_jar)
+        for tag, res in todo:
+            major, minor = tag
+            if isinstance(res, ReductionError):
+                self.logger.debug("ReductionError for %s(%s)."%(major, minor))
+                continue
 
-                except ReductionError:
-                    self.logger.debug("ReductionError for %s(%s)."%(major, minor))
+            if major not in outputs:
+                outputs[major] = []
+            outputs[major].append((minor, res))
+            self.logger.debug(fmtstr%(major, minor, pretty_dict(res.data)))
 
-            todo = todo.difference(collect)
-            time.sleep(sleep)
+            if self.pickle_jar is not None:
+                Conductor.dump(self.outputs, self.pickle_jar)
 
         return outputs
 
@@ -156,11 +251,12 @@ class Conductor(object):
         for major, minor in tags:
             if major in avg:
                 continue
-            avg[major] = OrderedDict()
-            n = len(outputs[major])
+            sums = OrderedDict()
             for minor, output in outputs[major]:
                 for k, v in output.data.items():
-                    avg[major][k] =  avg[major].get(k, 0.0) + float(v)/n
+                    sums[k] = sums.get(k, 0.0) + float(v)
+            n = len(outputs[major])
+            avg[major] = OrderedDict((k, s/n) for k, s in sums.items())
 
             self.logger.info(fmtstr%(major, "avg", pretty_dict(avg[major])))
 
@@ -207,26 +303,21 @@ class Conductor(object):
 
         # base case
         if self.threads > 1:
-            todo = set()
-            for tag in inputs:
-                todo.add((tag, self.pool.apply_async(play, inputs[tag])))
-
-            current = self.wait_on(current, todo)
-
+            # arguments are pickled on their way to the workers, so matrices in them are private copies
+            todo = self.pool.imap_unordered(partial(_play_star, private=True), inputs.items(), chunksize=1)
         else:
-            fmtstr = self._majorminor_format_str()
-            for tag in inputs:
-                major, minor = tag
-                try:
-                    res = play(*inputs[tag])
-                    current[major].append((minor, res))
-                    self.logger.debug(fmtstr%(major, minor, pretty_dict(res.data)))
+            todo = map(_play_star, inputs.items())
 
-                    if self.pickle_jar is not None:
-                        Conductor.dump(self.outputs, self.pickle_jar)
+        # results of earlier calls stay in front, only those of this call are reordered below
+        offsets = dict((major, len(current[major])) for major, minor in inputs)
 
-                except ReductionError:
-                    self.logger.debug("ReductionError for %s(%s)."%(major, minor))
+        current = self.wait_on(current, todo)
+
+        # results are stored in order of completion, restore the order in which jobs were given
+        order = dict((tag, i) for i, tag in enumerate(inputs))
+        for major, offset in offsets.items():
+            current[major][offset:] = sorted(current[major][offset:],
+                                             key=lambda output: order[(major, output[0])])
 
         self.logger.debug("")
 
@@ -241,7 +332,7 @@ class Conductor(object):
 
 def compare_bkz(classes, matrixf, dimensions, block_sizes, progressive_step_size,
                 seed, threads=2, samples=2, tours=1,
-                pickle_jar=None, logger="compare"):
+                pickle_jar=None, logger="compare", filenames=()):
     """
     Compare BKZ-style lattice reduction.
 
@@ -255,11 +346,20 @@ def compare_bkz(classes, matrixf, dimensions, block_sizes, progressive_step_size
     :param samples: number of reductions to perform
     :param tours: number of BKZ tours to run
     :param log_filename: log to this file if not ``None``
+    :param filenames: files some of the ``classes`` were loaded from, see ``names_to_classes``
+
+    ..  note :: Sample matrices are cached across calls, see ``_random_matrix``.  Up to 128 matrices
+        are kept for the lifetime of the process and are inherited by forked workers, which may be
+        a lot of memory in large dimensions.  Call ``_cached_random_matrix.cache_clear()`` to
+        release them.
 
     """
 
     jobs = []
 
+    # with fork-based workers, pass matrices by key and let workers inherit them
+    share = threads > 1 and _mp_context().get_start_method() == "fork"
+
     for dimension in dimensions:
 
         jobs.append((dimension, []))
@@ -272,10 +372,14 @@ def compare_bkz(classes, matrixf, dimensions, block_sizes, progressive_step_size
             jobs_ = []
 
             matrixf_ = matrixf(dimension=dimension, block_size=block_size)
+            # keyword arguments for ``_random_matrix``, built once instead of once per sample
+            matrix_kwds = tuple(sorted(matrixf_.items()))
 
             for i in range(samples):
-                FPLLL.set_random_seed(seed_)
-                A = IntegerMatrix.random(dimension, **matrixf_)
+                A = _random_matrix(dimension, seed_, matrix_kwds)
+                if share:
+                    _SHARED[(dimension, block_size, seed_)] = A
+                    A = (dimension, block_size, seed_)
 
                 for BKZ_ in classes:
                     args = (BKZ_, A, block_size, tours, progressive_step_size)
@@ -284,21 +388,61 @@ def compare_bkz(classes, matrixf, dimensions, block_sizes, progressive_step_size
 
             jobs[-1][1].append((block_size, jobs_))
 
-    conductor = Conductor(threads=threads, pickle_jar=pickle_jar, logger=logger)
-    return conductor(jobs)
+    # forked workers inherit loaded modules, otherwise each worker loads them once on startup so that
+    # classes defined there can be unpickled
+    initializer = _load_sources if filenames and not share else None
+    conductor = Conductor(threads=threads, pickle_jar=pickle_jar, logger=logger,
+                          initializer=initializer, initargs=(tuple(filenames),))
+    try:
+        outputs = conductor(jobs)
+    except BaseException:
+        # don't wait for the remaining jobs, their results would be thrown away
+        conductor.terminate()
+        raise
+    else:
+        conductor.close()
+    finally:
+        _SHARED.clear()
+    return outputs
 
 
 # Example
 
+# methods making up a tour of ``fpylll.algorithms.bkz.BKZReduction``
+_TOUR_METHODS = ("tour", "svp_preprocessing", "svp_call", "svp_postprocessing", "svp_reduction")
+
+
 class BKZGlue(object):
     "Base class for producing new BKZ classes with some parameters fixed."
+    native = False
+
     def tour(self, params, min_row=0, max_row=-1, tracer=dummy_tracer):
         if isinstance(params, int):
             params = BKZ.Param(block_size=params, **self.kwds)
+        if self.native:
+            return self.native_tour(params, min_row=min_row, max_row=max_row)
         return self.base.tour(self, params, min_row=min_row, max_row=max_row, tracer=tracer)
 
+    def native_tour(self, params, min_row=0, max_row=-1):
+        """
+        One tour of fplll's C++ BKZ on ``self.M``.  No statistics are collected below the tour level.
+
+        :param params: BKZ parameters
+        :param min_row: start index ≥ 0
+        :param max_row: last index ≤ n
 
-def BKZFactory(name, BKZBase, **kwds):
+        :returns: ``True`` if no change was made and ``False`` otherwise
+        """
+        if max_row == -1:
+            max_row = self.A.nrows
+        if getattr(self, "_native", None) is None:
+            # ``tour`` is passed its parameters explicitly, hence one object serves all tours
+            self._native = BKZ.Reduction(self.M, self.lll_obj, params)
+        clean, _ = self._native.tour(0, params, min_row, max_row)
+        return clean
+
+
+def BKZFactory(name, BKZBase, native=False, **kwds):
     """
     Return a new BKZ class, derived from ``BKZBase`` with given ``name``.  The resulting class
     accepts a single ``block_size`` parameter for ``tour`` and substitutes it with a ``BKZ.Param```
@@ -312,15 +456,32 @@ def BKZFactory(name, BKZBase, **kwds):
 
     :param name: name for output class
     :param BKZBase: base class to base this class on
+    :param native: run tours in fplll's C++ BKZ instead of ``BKZBase.tour``, this skips the Python
+        tour loop and its tracer callbacks and hence requires that ``BKZBase`` does not override
+        ``tour`` or any of the SVP methods it calls
+
+    Classes whose tours differ from fplll's cannot be run natively::
+
+        >>> BKZFactory('BKZ2_NATIVE', BKZ2, native=True)
+        Traceback (most recent call last):
+        ...
+        ValueError: Class 'BKZReduction' overrides 'svp_preprocessing' and cannot be run natively.
 
     """
-    NEW_BKZ = type(name, (BKZGlue, BKZBase), {"kwds": kwds, "base": BKZBase})
+    if native:
+        for method in _TOUR_METHODS:
+            if getattr(BKZBase, method) is not getattr(fpylll.algorithms.bkz.BKZReduction, method):
+                raise ValueError("Class '%s' overrides '%s' and cannot be run natively."%(BKZBase.__name__,
+                                                                                           method))
+    NEW_BKZ = type(name, (BKZGlue, BKZBase), {"kwds": kwds, "base": BKZBase, "native": native})
     globals()[name] = NEW_BKZ  # this is a HACK to enable pickling
     return NEW_BKZ
 
 
 BKZ1 = BKZFactory("BKZ1", fpylll.algorithms.bkz.BKZReduction)
 BKZ2 = BKZFactory("BKZ2", fpylll.algorithms.bkz2.BKZReduction, strategies=BKZ.DEFAULT_STRATEGY)
+FPLLL_BKZ2 = BKZFactory("FPLLL_BKZ2", fpylll.algorithms.bkz.BKZReduction, native=True,
+                        strategies=BKZ.DEFAULT_STRATEGY)
 
 
 # Main
@@ -354,6 +515,27 @@ def setup_logging(name, verbose=False):
     return log_name
 
 
+def _load_sources(filenames):
+    """
+    Load each file in ``filenames`` as a module ``compare_module%03d`` and return these modules.
+
+    :param filenames: a list of Python source files
+
+    """
+    import importlib.util
+
+    modules = []
+    for i, fn in enumerate(filenames):
+        name = "compare_module%03d"%i
+        spec = importlib.util.spec_from_file_location(name, fn)
+        module = importlib.util.module_from_spec(spec)
+        # register before executing, like ``import`` does, so that classes can be pickled
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        modules.append(module)
+    return modules
+
+
 def names_to_classes(class_names, filenames):
     """
     Try to find a class for each name in ``class_names``.  Classes implemented in one of the
@@ -370,15 +552,13 @@ def names_to_classes(class_names, filenames):
     :param filenames:
 
     """
-    import imp
     import os
     import re
 
     classes = class_names
     classes = [globals().get(clas, clas) for clas in classes]
 
-    for i, fn in enumerate(filenames):
-        tmp = imp.load_source("compare_module%03d"%i, fn)
+    for fn, tmp in zip(filenames, _load_sources(filenames)):
         # find the class by name in the module
         classes = [tmp.__dict__.get(clas, clas) for clas in classes]
 
@@ -432,6 +612,7 @@ if __name__ == '__main__':
                           progressive_step_size=args.progressive_step_size,
                           dimensions=args.dimensions,
                           logger=name,
+                          filenames=args.files,
                           pickle_jar=log_filename + ".sobj",
                           seed=args.seed,
                           threads=args.threads,
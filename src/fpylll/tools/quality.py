@@ -5,7 +5,14 @@
 
 from math import log, exp
 from collections import OrderedDict
-from fpylll.util import gaussian_heuristic
+from itertools import accumulate
+from fpylll.util import ball_log_vol
+from fpylll.fplll.gso import MatGSO
+
+try:
+    from fpylll.numpy import dump_r
+except ImportError:
+    dump_r = None
 
 
 def get_current_slope(r, start_row=0, stop_row=-1):
@@ -22,15 +29,21 @@ def get_current_slope(r, start_row=0, stop_row=-1):
         -0.085500625...
         >>> get_current_slope(M.r(), 0, 100) # doctest: +ELLIPSIS
         -0.085500625...
+        >>> abs(M.get_current_slope(10, 60) - get_current_slope(M.r(), 10, 60)) < 1e-9
+        True
 
     """
-    x = [log(r[i]) for i in range(start_row, stop_row)]
-    n = stop_row - start_row
-    i_mean = (n - 1) * 0.5 + start_row
+    return _current_slope([log(r[i]) for i in range(start_row, stop_row)])
+
+
+def _current_slope(x):
+    "Return the slope of the least squares fit through the points `(i, x_i)`."
+    n = len(x)
+    i_mean = (n - 1) * 0.5
     x_mean = sum(x)/n
     v1, v2 = 0.0, 0.0
 
-    for i in range(start_row, stop_row):
+    for i in range(n):
         v1 += (i - i_mean) * (x[i] - x_mean)
         v2 += (i - i_mean) * (i - i_mean)
     return v1 / v2
@@ -77,25 +90,34 @@ def basis_quality(M):
 
     try:
         d = M.d
-        r = [M.get_r(i, i) for i in range(d)]
+        if dump_r is not None and isinstance(M, MatGSO):
+            # one native call instead of d calls to ``get_r``
+            r = dump_r(M, 0, d).tolist()
+        else:
+            r = [M.get_r(i, i) for i in range(d)]
     except AttributeError:
         d = len(M)
         r = M
 
     ret = OrderedDict()
 
-    log_volume = sum(log(r_)/2 for r_ in r)
+    # cs[j] = ∑_{i<j} log(r_i), all volumes below are differences of these prefix sums
+    log_r = [log(r_) for r_ in r]
+    cs = [0.0]
+    cs.extend(accumulate(log_r))
+    log_volume = cs[d]/2
 
-    lhs = sum(log(r_)/2 for r_ in r[:d//2])
-    rhs = sum(log(r_)/2 for r_ in r[d//2 + (d%2):])
+    lhs = cs[d//2]/2
+    rhs = (cs[d] - cs[d//2 + (d%2)])/2
 
     ret["r_0"] = r[0]
-    ret["r_0/gh"] = r[0]/gaussian_heuristic(r)
-    ret["rhf"] = exp((log(r[0])/2.0 - log_volume/d)/d)
+    # Gaussian heuristic, cf. ``gaussian_heuristic``, from the already computed log-volume
+    ret["r_0/gh"] = r[0]/exp(2*(log_volume - ball_log_vol(d))/d)
+    ret["rhf"] = exp((cs[1]/2.0 - log_volume/d)/d)
     try:
         ret['/'] = M.get_current_slope(0, d)
     except AttributeError:
-        ret["/"] = get_current_slope(M, 0, d)
+        ret["/"] = _current_slope(log_r)
     ret["hv/hv"] = exp((lhs - rhs)/d)
 
     return ret
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Test the job handling of ``fpylll.tools.compare``.
+
+Jobs use stand-in BKZ classes and a stand-in for ``play`` whose jobs sleep for ``tours/10``
+seconds, so that timing and failures can be controlled.  Tests running the stand-in in worker
+pools are skipped unless workers fork, since only forked workers see it.
+"""
+import sys
+import time
+
+import pytest
+
+from fpylll import IntegerMatrix, FPLLL
+from fpylll.tools import compare
+from fpylll.tools.bkz_stats import Node
+from fpylll.tools.compare import Conductor, compare_bkz
+from fpylll.util import randint
+
+
+class Slow(object):
+    "Stand-in BKZ class."
+
+
+class Broken(object):
+    "Stand-in BKZ class whose jobs fail."
+
+
+# pool workers only see the stand-ins if they are forked
+needs_fork = pytest.mark.skipif(compare._mp_context().get_start_method() != "fork",
+                                reason="worker pools do not fork on this platform")
+
+
+def fake_play(BKZ, A, block_size, tours, progressive_step_size=None):
+    if BKZ is Broken:
+        raise ValueError("broken")
+    time.sleep(tours/10.)
+    return Node("bkz", data={"tours": tours})
+
+
+def spy(monkeypatch, name, calls):
+    method = getattr(Conductor, name)
+
+    def wrapper(self):
+        calls.append(name)
+        return method(self)
+
+    monkeypatch.setattr(Conductor, name, wrapper)
+
+
+def run(classes, tours, samples=4, threads=2):
+    return compare_bkz(classes, compare.qary30, dimensions=(30,), block_sizes=(10,),
+                       progressive_step_size=None, seed=1, threads=threads, samples=samples,
+                       tours=tours)
+
+
+@needs_fork
+def test_compare_bkz_close(monkeypatch):
+    monkeypatch.setattr(compare, "play", fake_play)
+    calls = []
+    spy(monkeypatch, "close", calls)
+    spy(monkeypatch, "terminate", calls)
+
+    outputs = run([Slow], tours=1, samples=2)
+    assert calls == ["close"]
+    assert [seed for seed, trace in outputs[30][10]["Slow"]] == [1, 2]
+    assert not compare._SHARED
+
+
+@needs_fork
+def test_compare_bkz_terminate(monkeypatch):
+    monkeypatch.setattr(compare, "play", fake_play)
+    calls = []
+    spy(monkeypatch, "close", calls)
+    spy(monkeypatch, "terminate", calls)
+
+    with pytest.raises(ValueError):
+        run([Broken, Slow], tours=10)
+    # the pool was not waited on
+    assert calls == ["terminate"]
+    assert not compare._SHARED
+
+
+@needs_fork
+def test_conductor_order(monkeypatch):
+    monkeypatch.setattr(compare, "play", fake_play)
+    conductor = Conductor(threads=2)
+    try:
+        # the first job finishes last
+        outputs = conductor([(("X", 1), (Slow, None, 10, 5)), (("X", 2), (Slow, None, 10, 0))])
+    finally:
+        conductor.close()
+    assert [minor for minor, trace in outputs["X"]] == [1, 2]
+
+
+def check_conductor_reuse(threads):
+    conductor = Conductor(threads=threads)
+    try:
+        conductor([(("X", 1), (Slow, None, 10, 0))])
+        outputs = conductor([(("X", 3), (Slow, None, 10, 1)), (("X", 2), (Slow, None, 10, 0))])
+    finally:
+        conductor.close()
+    assert [minor for minor, trace in outputs["X"]] == [1, 3, 2]
+
+
+def test_conductor_reuse(monkeypatch):
+    monkeypatch.setattr(compare, "play", fake_play)
+    check_conductor_reuse(threads=1)
+
+
+@needs_fork
+def test_conductor_reuse_threaded(monkeypatch):
+    monkeypatch.setattr(compare, "play", fake_play)
+    check_conductor_reuse(threads=2)
+
+
+def test_random_matrix():
+    kwds = tuple(sorted(compare.qary30(dimension=30, block_size=10).items()))
+    compare._cached_random_matrix.cache_clear()
+
+    A = compare._random_matrix(30, 1, kwds)
+    a = randint(0, 2**30)
+    B = compare._random_matrix(30, 1, kwds)
+    b = randint(0, 2**30)
+    assert compare._cached_random_matrix.cache_info().hits == 1
+    # cached or not, the matrix and the state of the random number generator are the same
+    assert A == B
+    assert a == b
+
+    FPLLL.set_random_seed(1)
+    assert A == IntegerMatrix.random(30, **dict(kwds))
+
+    # modifying a returned matrix does not modify the cache
+    B[0, 0] += 1
+    assert compare._random_matrix(30, 1, kwds) == A
+
+
+class Bits(object):
+    "An unhashable number of bits."
+    __hash__ = None
+
+    def __int__(self):
+        return 20
+
+
+def test_random_matrix_unhashable():
+    compare._cached_random_matrix.cache_clear()
+    A = compare._random_matrix(30, 1, (("algorithm", "uniform"), ("bits", Bits())))
+    FPLLL.set_random_seed(1)
+    assert A == IntegerMatrix.random(30, "uniform", bits=20)
+    assert compare._cached_random_matrix.cache_info().currsize == 0
+
+
+def test_play_native():
+    FPLLL.set_random_seed(1)
+    A = IntegerMatrix.random(30, **compare.qary30(dimension=30, block_size=10))
+    trace = compare.play(compare.FPLLL_BKZ2, A, 10, 2)
+
+    assert [node.label for node in trace.find_all("tour")] == [("tour", (10, 0)), ("tour", (10, 1))]
+    for key in ("r_0", "r_0/gh", "rhf", "/", "hv/hv"):
+        assert key in trace.data
+    # ``play`` reduces a copy
+    FPLLL.set_random_seed(1)
+    assert A == IntegerMatrix.random(30, **compare.qary30(dimension=30, block_size=10))
+
+
+def test_native_tour_reuse():
+    FPLLL.set_random_seed(1)
+    bkz = compare.FPLLL_BKZ2(IntegerMatrix.random(30, **compare.qary30(dimension=30, block_size=10)))
+    bkz.tour(10)
+    native = bkz._native
+    bkz.tour(10)
+    assert bkz._native is native
+
+
+def test_native_overrides():
+    from fpylll.algorithms.bkz2 import BKZReduction as BKZ2
+
+    with pytest.raises(ValueError):
+        compare.BKZFactory("BKZ2_NATIVE", BKZ2, native=True)
+
+
+def test_load_sources(tmp_path):
+    fn = tmp_path / "bkz_foo.py"
+    fn.write_text(u"from fpylll.tools.compare import BKZ1\n\n\nclass BKZ_FOO(BKZ1):\n    pass\n")
+    names = compare.names_to_classes(["BKZ_FOO"], [str(fn)])
+    assert names[0].__name__ == "BKZ_FOO"
+    assert names[0].__module__ == "compare_module000"
+    assert sys.modules["compare_module000"].BKZ_FOO is names[0]
+
+
+def test_compare_bkz_spawn(monkeypatch, tmp_path):
+    import multiprocessing
+
+    monkeypatch.setattr(compare, "_mp_context", lambda: multiprocessing.get_context("spawn"))
+    initializers = []
+
+    class Conductor_(Conductor):
+        def __init__(self, *args, **kwds):
+            initializers.append(kwds.get("initializer"))
+            Conductor.__init__(self, *args, **kwds)
+
+    monkeypatch.setattr(compare, "Conductor", Conductor_)
+
+    # without files, workers need no initializer
+    outputs = run([compare.BKZ1], tours=1, samples=1)
+    assert [seed for seed, trace in outputs[30][10]["BKZ1"]] == [1]
+    assert initializers == [None]
+
+    # spawned workers load classes defined in files
+    fn = tmp_path / "bkz_foo.py"
+    fn.write_text(u"from fpylll.tools.compare import BKZ1\n\n\nclass BKZ_FOO(BKZ1):\n    pass\n")
+    classes = compare.names_to_classes(["BKZ_FOO"], [str(fn)])
+    outputs = compare_bkz(classes, compare.qary30, dimensions=(30,), block_sizes=(10,),
+                          progressive_step_size=None, seed=1, threads=2, samples=1, tours=1,
+                          filenames=[str(fn)])
+    assert [seed for seed, trace in outputs[30][10]["BKZ_FOO"]] == [1]
+    assert initializers[-1] is compare._load_sources
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+from fpylll import IntegerMatrix, GSO, LLL, FPLLL
+from fpylll.tools.quality import basis_quality
+
+
+class DuckGSO(object):
+    "Not a ``MatGSO`` but provides what ``basis_quality`` needs."
+
+    def __init__(self, M):
+        self.d = M.d
+        self._M = M
+
+    def get_r(self, i, j):
+        return self._M.get_r(i, j)
+
+
+def test_basis_quality_duck_typed():
+    FPLLL.set_random_seed(1337)
+    A = LLL.reduction(IntegerMatrix.random(40, "qary", k=20, bits=20))
+    M = GSO.Mat(A)
+    M.update_gso()
+
+    expected = basis_quality(M)
+    quality = basis_quality(DuckGSO(M))
+    assert list(quality) == list(expected)
+    for key in expected:
+        assert abs(quality[key] - expected[key]) < 1e-6*abs(expected[key])